@@ -1,25 +1,159 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+import time
 
-# ==============================       
+# ==============================
+
+class Progress:
+    """
+    Handle on an analysis performed in the background:
+    partial results, throughput and cooperative cancellation.
+    """
+
+    def __init__(self, analysis):
+        self.analysis = analysis
+        self.n_total = None
+        self.n_done = 0
+        self.n_batches = 0
+        self.start_time = None
+        self.elapsed = 0.0
+        self.lock = threading.Lock()
+        self.future = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def results(self):
+        """Copy of the results of the batches completed so far"""
+        with self.lock:
+            return self.analysis.results.copy()
+
+    @property
+    def throughput(self):
+        """Features processed per second"""
+        return self.n_done / self.elapsed if self.elapsed>0 else 0.0
+
+    @property
+    def remaining_time(self):
+        """Estimated remaining time in seconds"""
+        if self.n_total is None or self.throughput==0:
+            return None
+        return (self.n_total - self.n_done) / self.throughput
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        """Stop after the current batch; completed batches are still finalized and saved"""
+        self._cancel_event.set()
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def start(self, n_total):
+        """Start the clock once the data are prepared, so that throughput only counts feature processing"""
+        self.n_total = n_total
+        self.start_time = time.monotonic()
+
+    def update(self, n_done):
+        self.n_done = n_done
+        self.n_batches += 1
+        self.elapsed = time.monotonic() - self.start_time
+
+    def __await__(self):
+        return asyncio.wrap_future(self.future).__await__()
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__} ["
+                f"analysis = {self.analysis.name}, "
+                f"done = {self.n_done}/{self.n_total}, "
+                f"batches = {self.n_batches}, "
+                f"throughput = {self.throughput:.1f}/s, "
+                f"cancelled = {self.cancelled}"
+                f"]")
+
+# ==============================
 
 class Analysis(ABC):
-    
+
+    batch_size = 1000
+
     @property
     @abstractmethod
     def name(self) -> str:
         ...
-    
+
     @abstractmethod
     def perform(self):
         ...
-    
+
     @property
     @abstractmethod
     def results_dir(self):
         ...
-        
+
     @abstractmethod
     def save_results(self) -> dict:
         ...
 
-# ============================== 
+    def start(self, batch_size=None, executor=None) -> Progress:
+        """Perform the analysis in a background executor and return its progress handle"""
+        progress = Progress(self)
+        batch_size = self.batch_size if batch_size is None else batch_size
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=1)
+            progress.future = executor.submit(self._perform_batches, progress, batch_size)
+            executor.shutdown(wait=False)
+        else:
+            progress.future = executor.submit(self._perform_batches, progress, batch_size)
+        return progress
+
+    async def perform_async(self, batch_size=None, executor=None):
+        """
+        Awaitable analysis; cancelling the awaiting task cancels the analysis after the current batch,
+        and the cancellation is raised once the completed batches are finalized and saved
+        """
+        progress = self.start(batch_size=batch_size, executor=executor)
+        try:
+            return await progress
+        except asyncio.CancelledError:
+            progress.cancel()
+            if not progress.future.cancelled():
+                await asyncio.shield(asyncio.wrap_future(progress.future))
+            raise
+
+    def _perform_batches(self, progress, batch_size):
+        progress.start(self._prepare())
+        with progress.lock:
+            self._update_results(0)
+        for start in range(0, progress.n_total, batch_size):
+            if progress.cancelled:
+                break
+            stop = min(start + batch_size, progress.n_total)
+            self._perform_batch(start, stop)
+            with progress.lock:
+                self._update_results(stop)
+            progress.update(stop)
+        self._finalize()
+        return self.results
+
+    @abstractmethod
+    def _prepare(self) -> int:
+        """Prepare the data and return the number of features to process"""
+        ...
+
+    @abstractmethod
+    def _perform_batch(self, start, stop):
+        ...
+
+    @abstractmethod
+    def _update_results(self, n_done):
+        ...
+
+    @abstractmethod
+    def _finalize(self):
+        ...
+
+# ==============================
@@ -0,0 +1,240 @@
+from abc import ABC, abstractmethod
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import tempfile
+import math
+import os
+
+# ==============================
+
+class Correction(ABC):
+    """
+    Multiple-testing correction interface.
+    Corrects one or several columns of p-values at once (one argsort per column).
+    NaN p-values are skipped: they are not counted in the number of tests
+    and remain NaN in the output.
+    """
+
+    step_up = True
+    lambda_ = None
+
+    def perform(self, p_vals):
+        values = np.asarray(p_vals, dtype=float)
+        is_vector = values.ndim==1
+        if is_vector:
+            values = values[:, np.newaxis]
+        adjusted = np.full(values.shape, np.nan)
+        if values.shape[0]>0:
+            orders = np.argsort(values, axis=0, kind='stable')
+            sorted_values = np.take_along_axis(values, orders, axis=0)
+            n = (~np.isnan(values)).sum(axis=0)
+            n_above = (values>self.lambda_).sum(axis=0) if self.lambda_ is not None else np.zeros_like(n)
+            ranks = np.arange(1, values.shape[0] + 1)[:, np.newaxis]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                sorted_adjusted = sorted_values * self.factors(ranks, n, n_above)
+            sorted_adjusted = np.where(np.isnan(sorted_values), np.nan, self.accumulate(sorted_adjusted))
+            np.put_along_axis(adjusted, orders, np.minimum(sorted_adjusted, 1), axis=0)
+        if is_vector:
+            adjusted = adjusted[:, 0]
+        if isinstance(p_vals, pd.DataFrame):
+            return pd.DataFrame(adjusted, index=p_vals.index, columns=p_vals.columns)
+        if isinstance(p_vals, pd.Series):
+            return pd.Series(adjusted, index=p_vals.index, name=p_vals.name)
+        return adjusted
+
+    def accumulate(self, sorted_adjusted, carry=None):
+        """Enforce monotonicity of adjusted p-values sorted by increasing p-value (NaN ignored)"""
+        if self.step_up:
+            accumulated = np.fmin.accumulate(sorted_adjusted[::-1], axis=0)[::-1]
+            return accumulated if carry is None else np.fmin(accumulated, carry)
+        accumulated = np.fmax.accumulate(sorted_adjusted, axis=0)
+        return accumulated if carry is None else np.fmax(accumulated, carry)
+
+    @abstractmethod
+    def factors(self, ranks, n, n_above):
+        """Multiplier of the p-value of a given rank among n tests"""
+        ...
+
+# ==============================
+
+class BenjaminiHochberg(Correction):
+    """Benjamini-Hochberg step-up false discovery rate"""
+
+    def factors(self, ranks, n, n_above):
+        return n / ranks
+
+# ==============================
+
+class BenjaminiYekutieli(Correction):
+    """
+    Benjamini-Yekutieli step-up false discovery rate under arbitrary dependence.
+    The harmonic number H(n) is summed exactly up to exact_limit tests and taken
+    from its asymptotic expansion above, so factors() needs no array of size n.
+    """
+
+    exact_limit = 100_000
+
+    def factors(self, ranks, n, n_above):
+        n = np.asarray(n)
+        unique_n, inverse = np.unique(n, return_inverse=True)
+        harmonic = np.array([self.harmonic(int(k)) for k in unique_n])[inverse].reshape(n.shape)
+        return n * harmonic / ranks
+
+    @classmethod
+    @lru_cache(maxsize=64)
+    def harmonic(cls, n):
+        if n<=cls.exact_limit:
+            return float(np.sum(1.0 / np.arange(n, 0, -1)))
+        return math.log(n) + np.euler_gamma + 1 / (2 * n) - 1 / (12 * n**2) + 1 / (120 * n**4)
+
+# ==============================
+
+class Holm(Correction):
+    """Holm step-down family-wise error rate"""
+
+    step_up = False
+
+    def factors(self, ranks, n, n_above):
+        return n - ranks + 1
+
+# ==============================
+
+class StoreyQValue(Correction):
+    """Storey q-values with the proportion of true null hypotheses estimated at a given lambda"""
+
+    def __init__(self, lambda_=0.5):
+        self.lambda_ = lambda_
+
+    def pi0(self, n, n_above):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.minimum(1, np.maximum(n_above, 1) / (n * (1 - self.lambda_)))
+
+    def factors(self, ranks, n, n_above):
+        return self.pi0(n, n_above) * n / ranks
+
+# ==============================
+
+class ExternalCorrection:
+    """
+    Correction of p-value sets too large for memory.
+    P-values are read as a stream of chunks and written to disk without NaNs.
+    They are then distributed into buckets of increasing values with a histogram
+    over their range; buckets larger than bucket_size are partitioned again over
+    their own range until they fit, or until they only hold ties, which are read
+    in slices of bucket_size. Each bucket is sorted in memory and the adjusted
+    p-values are written in the input order to a memory-mapped output file.
+    Files are appended chunk by chunk, so few files are open at any time.
+    """
+
+    n_bins = 2**16
+
+    def __init__(self, correction: Correction, directory=None, chunk_size=10_000_000, bucket_size=10_000_000):
+        self.correction = correction
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.bucket_size = bucket_size
+
+    def perform(self, chunks, output_filename) -> np.memmap:
+        with tempfile.TemporaryDirectory(dir=self.directory) as tmp_dir:
+            self._tmp_dir = tmp_dir
+            self._n_files = 0
+            source = self._new_file()
+            n_total, n_above = 0, 0
+            lowest, highest = np.inf, -np.inf
+            with open(source + '.p', 'wb') as f, open(source + '.pos', 'wb') as f_pos:
+                for chunk in chunks:
+                    chunk = np.asarray(chunk, dtype=float).ravel()
+                    positions = np.flatnonzero(~np.isnan(chunk))
+                    valid = chunk[positions]
+                    valid.tofile(f)
+                    (positions + n_total).tofile(f_pos)
+                    n_total += len(chunk)
+                    if len(valid)>0:
+                        lowest, highest = min(lowest, valid.min()), max(highest, valid.max())
+                    if self.correction.lambda_ is not None:
+                        n_above += int((valid>self.correction.lambda_).sum())
+            n = os.path.getsize(source + '.p') // np.dtype(float).itemsize
+            output = np.memmap(output_filename, dtype=float, mode='w+', shape=(max(1, n_total),))[:n_total]
+            for start in range(0, n_total, self.chunk_size):
+                output[start:start + self.chunk_size] = np.nan
+            buckets = self._partition(source, n, lowest, highest) if n>0 else []
+            self._adjust_buckets(output, buckets, n, n_above)
+            output.flush()
+        return output
+
+    def _new_file(self):
+        self._n_files += 1
+        return os.path.join(self._tmp_dir, f"part_{self._n_files}")
+
+    def _read(self, source, size):
+        p_vals = np.memmap(source + '.p', dtype=float, mode='r', shape=(size,))
+        positions = np.memmap(source + '.pos', dtype=np.int64, mode='r', shape=(size,))
+        for start in range(0, size, self.chunk_size):
+            yield np.array(p_vals[start:start + self.chunk_size]), np.array(positions[start:start + self.chunk_size])
+
+    def _get_bins(self, p_vals, lowest, highest):
+        return np.clip(((p_vals - lowest) / (highest - lowest) * self.n_bins).astype(np.int64), 0, self.n_bins - 1)
+
+    def _get_buckets(self, counts):
+        """Group consecutive bins into buckets of at most bucket_size p-values (a heavier bin is a bucket on its own)"""
+        bucket_of_bin = np.zeros(self.n_bins, dtype=np.int64)
+        bucket, size = 0, 0
+        for i, count in enumerate(counts):
+            if size>0 and size + count>self.bucket_size:
+                bucket, size = bucket + 1, 0
+            bucket_of_bin[i] = bucket
+            size += count
+        return bucket_of_bin
+
+    def _partition(self, source, size, lowest, highest):
+        """Ordered list of (file, size, start, stop) slices of at most bucket_size p-values"""
+        if size<=self.bucket_size or lowest==highest:
+            return [(source, size, start, min(start + self.bucket_size, size)) for start in range(0, size, self.bucket_size)]
+        counts = np.zeros(self.n_bins, dtype=np.int64)
+        for p_vals, _ in self._read(source, size):
+            counts += np.bincount(self._get_bins(p_vals, lowest, highest), minlength=self.n_bins)
+        bucket_of_bin = self._get_buckets(counts)
+        n_buckets = int(bucket_of_bin[-1]) + 1
+        bucket_files = [self._new_file() for _ in range(n_buckets)]
+        bucket_sizes = np.zeros(n_buckets, dtype=np.int64)
+        bucket_lowest = np.full(n_buckets, np.inf)
+        bucket_highest = np.full(n_buckets, -np.inf)
+        for p_vals, positions in self._read(source, size):
+            buckets = bucket_of_bin[self._get_bins(p_vals, lowest, highest)]
+            order = np.argsort(buckets, kind='stable')
+            chunk_buckets, bounds = np.unique(buckets[order], return_index=True)
+            bounds = np.append(bounds, len(order))
+            for b, first, last in zip(chunk_buckets, bounds[:-1], bounds[1:]):
+                selection = order[first:last]
+                with open(bucket_files[b] + '.p', 'ab') as f, open(bucket_files[b] + '.pos', 'ab') as f_pos:
+                    p_vals[selection].tofile(f)
+                    positions[selection].tofile(f_pos)
+                bucket_sizes[b] += len(selection)
+                bucket_lowest[b] = min(bucket_lowest[b], p_vals[selection].min())
+                bucket_highest[b] = max(bucket_highest[b], p_vals[selection].max())
+        os.remove(source + '.p')
+        os.remove(source + '.pos')
+        partitions = []
+        for b in range(n_buckets):
+            if bucket_sizes[b]>0:
+                partitions.extend(self._partition(bucket_files[b], int(bucket_sizes[b]), bucket_lowest[b], bucket_highest[b]))
+        return partitions
+
+    def _adjust_buckets(self, output, buckets, n, n_above):
+        offsets = np.concatenate([[0], np.cumsum([stop - start for _, _, start, stop in buckets])])
+        order_buckets = range(len(buckets))
+        if self.correction.step_up:
+            order_buckets = reversed(order_buckets)
+        carry = None
+        for b in order_buckets:
+            source, size, start, stop = buckets[b]
+            p_vals = np.array(np.memmap(source + '.p', dtype=float, mode='r', shape=(size,))[start:stop])
+            positions = np.array(np.memmap(source + '.pos', dtype=np.int64, mode='r', shape=(size,))[start:stop])
+            order = np.argsort(p_vals, kind='stable')
+            ranks = np.arange(offsets[b] + 1, offsets[b + 1] + 1)
+            adjusted = self.correction.accumulate(p_vals[order] * self.correction.factors(ranks, n, n_above), carry)
+            carry = adjusted[0] if self.correction.step_up else adjusted[-1]
+            output[positions[order]] = np.minimum(adjusted, 1)
+
+# ==============================
@@ -1,4 +1,4 @@
-from src.statgenex.service import FormatService, FileService, DataLoader
+from src.statgenex.service import FormatService, FileService, IndexService, DataLoader, NormalizationChain
 import json
 from abc import ABC, abstractmethod
 
@@ -127,19 +127,22 @@ class Dataset(Entity):
     def add_groups(self, groups: dict[str, 'Group']) -> None:
         self.groups = groups
     
-    def generate_groups(self, categorical_filters=None, quantitative_filters=None, expression_filters=None, secondary_filters=None):
-        expgroup_loader = DataLoader(filename=self.data_dir + self.expgroup_filename, ext=self.expgroup_ext, sep=self.expgroup_sep)
-        expgroup_loader.load()
-        expgroup = expgroup_loader.data
-        data_loader = DataLoader(filename=self.data_dir + self.data_filename, ext=self.expgroup_ext, sep=self.expgroup_sep)
-        data_loader.load()
-        expression_data = data_loader.data
+    def generate_groups(self, categorical_filters=None, quantitative_filters=None, expression_filters=None, secondary_filters=None, expgroup=None, expression_data=None, normalizers=None):
+        if expgroup is None:
+            expgroup_loader = DataLoader(filename=self.data_dir + self.expgroup_filename, ext=self.expgroup_ext, sep=self.expgroup_sep)
+            expgroup_loader.load()
+            expgroup = expgroup_loader.data
+        if expression_data is None:
+            data_loader = DataLoader(filename=self.data_dir + self.data_filename, ext=self.expgroup_ext, sep=self.expgroup_sep)
+            data_loader.load()
+            expression_data = data_loader.data
+        if normalizers:
+            expression_data = NormalizationChain(data=expression_data, normalizers=normalizers).transform()
         expression_data = expression_data.dropna(axis=1, how='all')
         expression_data = expression_data.dropna(axis=0, how='all')
         expression_data = expression_data.drop_duplicates()
-        common_samples = set(expgroup.index).intersection(set(expression_data.columns))
-        expression_data = expression_data[common_samples]
-        expgroup = expgroup.loc[common_samples]
+        expression_data = IndexService.take(expression_data, IndexService.get_positions(expression_data.columns, expgroup.index), axis=1)
+        expgroup = IndexService.take(expgroup, IndexService.get_positions(expgroup.index, expression_data.columns), axis=0)
         if categorical_filters is not None:
             self._generate_categorical_groups(expgroup, categorical_filters)
         if quantitative_filters is not None:
@@ -153,16 +156,17 @@ class Dataset(Entity):
         for group_name, expression_filter in expression_filters.items():
             ref_group_name = expression_filter['ref_group']
             ref_group_samples = self.groups[ref_group_name].samples
-            common_samples = set(expression_data.columns).intersection(set(ref_group_samples))
+            positions = IndexService.get_positions(expression_data.columns, ref_group_samples)
             gene_name = expression_filter['gene']
             if gene_name in expression_data.index:
                 if (expression_filter['threshold_type']=='median'):
-                    threshold = expression_data.loc[gene_name, common_samples].median()
+                    gene_expression = expression_data.loc[gene_name].iloc[positions]
+                    threshold = gene_expression.median()
                     query = None
                     if expression_filter['class']=='low':
-                        query = (expression_data.loc[gene_name, common_samples]<=threshold)
+                        query = (gene_expression<=threshold)
                     if expression_filter['class']=='high':
-                        query = (expression_data.loc[gene_name, common_samples]>threshold)
+                        query = (gene_expression>threshold)
                     group_samples = list(query.loc[query].index)
                     self.add_group(Group(name=group_name, samples=group_samples))
         
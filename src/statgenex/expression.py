@@ -1,6 +1,7 @@
-from src.statgenex import Analysis
-from src.statgenex.service import FormatService, FigureService, FileService, DataLoader, IndexReducer
-from src.statgenex.stats import BenjaminiHochberg
+from src.statgenex import Analysis, Progress
+from src.statgenex.service import FormatService, FigureService, FileService, DataLoader, IndexReducer, NormalizationChain
+from src.statgenex.correction import BenjaminiHochberg
+from src.statgenex.stats import OneWayAnova, GroupMoments, EffectSize, Bootstrap
 import pandas as pd
 import numpy as np
 from scipy.stats import f_oneway, kruskal
@@ -38,6 +39,17 @@ class Anova(Analysis):
         
         self.significance = {'pval_anova': 0.05, 'pval_kw': 0.05, 'fdr_anova': 0.05, 'fdr_kw': 0.05}
         
+        self.generate_effect_sizes = True
+        self.generate_confidence_intervals = False
+        self.n_resamples = 2000
+        self.confidence_level = 0.95
+        self.random_state = None
+        self.max_workers = None
+        
+        self.normalizers = []
+        self.expression_data = None
+        self.group_moments = None
+        
         for k, v in kwargs.items():
             setattr(self, k, v)
     
@@ -46,7 +58,13 @@ class Anova(Analysis):
         self.description = pd.DataFrame()
         self.description.index.name = 'group_name' 
         self.sample_sizes = pd.DataFrame(index=self.features)
-        self.aov_data_dict = dict()
+        self.confidence_intervals = pd.DataFrame(index=self.features)
+        self.confidence_intervals.index.name = 'gene'
+        self.expression_values = None
+        self.feature_positions = dict()
+        self.group_positions = dict()
+        self.n_features = 0
+        self.n_done = 0
     
     @property 
     def name(self):
@@ -58,15 +76,52 @@ class Anova(Analysis):
         return self.project.results_dir + self.local_dir
     
     def perform(self):
+        self._perform_batches(Progress(self), self.batch_size)
+    
+    def _prepare(self):
         dataset = self.project.datasets[self.dataset_name]
         expression_data = self._generate_expression_data()
+        # Duplicate gene labels (e.g. after probe to symbol mapping): keep the first row
+        expression_data = expression_data[~expression_data.index.duplicated()]
         self.available_group_names = [gn for gn in self.group_names if gn in dataset.groups.keys()]
         for group_name in self.available_group_names:
             self.description.loc[group_name, 'dataset_name'] = self.dataset_name
             self.description.loc[group_name, 'sample_size'] = len(dataset.groups[group_name].samples)
-        self._calculate_anova(dataset, expression_data)
+        self._index_expression_data(dataset, expression_data)
+        n_features = self.expression_values.shape[0]
+        self.expression_index = expression_data.index
+        self.pvals_anova = np.full(n_features, np.nan)
+        self.pvals_kw = np.full(n_features, np.nan)
+        self.h_kw = np.full(n_features, np.nan)
+        self.effect_sizes = dict()
+        self.moments = None
+        self.n_features = n_features
+        if self.group_moments is not None:
+            self.moments = self.group_moments.select(expression_data.index, self.available_group_names)
+        elif self.generate_effect_sizes:
+            self.moments = GroupMoments().perform(self.expression_values, self.group_positions, expression_data.index).select(expression_data.index, self.available_group_names)
+        self.n_done = 0
+        return n_features
+    
+    def _perform_batch(self, start, stop):
+        self._calculate_anova(start, stop)
+        if self.generate_effect_sizes:
+            batch_moments = [m[start:stop] for m in self.moments]
+            for k, v in EffectSize().perform(*batch_moments, self.h_kw[start:stop]).items():
+                self.effect_sizes.setdefault(k, np.full(len(self.h_kw), np.nan))[start:stop] = v
+    
+    def _update_results(self, n_done):
+        self.n_done = n_done
+        self.results['pval_anova'] = pd.Series(self.pvals_anova, index=self.expression_index)
+        self.results['pval_kw'] = pd.Series(self.pvals_kw, index=self.expression_index)
+        for k, v in self.effect_sizes.items():
+            self.results[k] = pd.Series(v, index=self.expression_index)
         self._calculate_fdr()
         self._calculate_significance()
+    
+    def _finalize(self):
+        if self.generate_confidence_intervals:
+            self._calculate_confidence_intervals()
         if self.generate_plots:
             FileService.create_folder(self.results_dir)
             self._generate_boxplots()
@@ -77,16 +132,16 @@ class Anova(Analysis):
         n_groups = len(self.available_group_names)
         figwidth = self.figwidth_scale*n_groups
         figsize = (figwidth, 4) if self.figsize is None else self.figsize
-        self.pdf_filename = self.results_dir + f"Anova_boxplots_{self.dataset_name}_{len(self.features)}_genes_{len(self.available_group_names)}_groups.pdf"
-        with PdfPages(self.pdf_filename) as pdf:
+        self.pdf_filename = self.results_dir + f"Anova_boxplots_{self.dataset_name}_{len(self.features)}_genes_{len(self.available_group_names)}_groups{self._get_partial_suffix()}.pdf"
+        with FigureService.lock, PdfPages(self.pdf_filename) as pdf:
             for feature in self.features:
-                if feature in self.aov_data_dict.keys():
-                    aov_data = self.aov_data_dict[feature]
+                if feature in self.feature_positions.keys() and self.feature_positions[feature]<self.n_done:
+                    aov_data = self._get_aov_data(feature)
                     fig, ax = plt.subplots(figsize=figsize)
                     ax.boxplot(aov_data, **self.boxplot_options)                    
                     self._add_annotations(ax, feature)
                     pdf.savefig(fig, bbox_inches='tight', orientation='landscape')
-                    plt.close('all')
+                    plt.close(fig)
     
     def _add_annotations(self, ax, feature):
         font = FigureService.create_arial_narrow_font()
@@ -130,52 +185,100 @@ class Anova(Analysis):
         self.results.loc[~query, 'significant'] = 0
         
     def _calculate_fdr(self):
-        bh = BenjaminiHochberg()
-        for test_name in ['anova', 'kw']:
-            p_vals = self.results['pval_' + test_name]
-            fdr = bh.perform(p_vals)
-            self.results['fdr_' + test_name] = fdr
+        test_names = ['anova', 'kw']
+        fdr = BenjaminiHochberg().perform(self.results[['pval_' + test_name for test_name in test_names]])
+        for test_name in test_names:
+            self.results['fdr_' + test_name] = fdr['pval_' + test_name]
         
-    def _calculate_anova(self, dataset, expression_data):
-        for feature in expression_data.index:
-            aov_data = []
-            for group_name in self.available_group_names:
-                group_samples = dataset.groups[group_name].samples
-                not_na_values = expression_data.loc[feature, group_samples].dropna()
-                self.sample_sizes.loc[feature, group_name] = len(not_na_values)
-                aov_data.append(list(not_na_values))
-            self.aov_data_dict[feature] = aov_data
+    def _calculate_anova(self, start, stop):
+        if self.group_moments is not None:
+            self.pvals_anova[start:stop] = OneWayAnova().perform(*[m[start:stop] for m in self.moments])
+        for i in range(start, stop):
+            aov_data = self._get_group_values(i)
             try:
                 with warnings.catch_warnings(record=True):
                     warnings.simplefilter("always")
-                    f_aov, pval_aov = f_oneway(*aov_data)
+                    if self.group_moments is None:
+                        f_aov, pval_aov = f_oneway(*aov_data)
+                        self.pvals_anova[i] = pval_aov
                     f_kw, pval_kw = kruskal(*aov_data)
-                    self.results.loc[feature, 'pval_anova'] = pval_aov
-                    self.results.loc[feature, 'pval_kw'] = pval_kw
+                    self.pvals_kw[i] = pval_kw
+                    self.h_kw[i] = f_kw
             except:
                 pass
+    
+    def _calculate_confidence_intervals(self):
+        bootstrap = Bootstrap(n_resamples=self.n_resamples, 
+                              confidence_level=self.confidence_level, 
+                              max_workers=self.max_workers, 
+                              random_state=self.random_state)
+        intervals = bootstrap.perform(self.expression_values[:self.n_done], self.group_positions)
+        for k, v in intervals.items():
+            self.confidence_intervals[k] = pd.Series(v, index=self.expression_index[:self.n_done])
+    
+    def _index_expression_data(self, dataset, expression_data):
+        """Keep a single contiguous array and the sample positions of each group"""
+        self.expression_values = np.ascontiguousarray(expression_data.to_numpy(dtype=float))
+        self.feature_positions = {feature: i for i, feature in enumerate(expression_data.index)}
+        self.group_positions = dict()
+        for group_name in self.available_group_names:
+            positions = expression_data.columns.get_indexer(dataset.groups[group_name].samples)
+            self.group_positions[group_name] = positions[positions>=0]
+        not_na = ~np.isnan(self.expression_values)
+        sample_sizes = {group_name: not_na[:, positions].sum(axis=1) for group_name, positions in self.group_positions.items()}
+        self.sample_sizes = pd.DataFrame(sample_sizes, index=expression_data.index, columns=self.available_group_names).reindex(self.features)
+    
+    def _get_group_values(self, position):
+        """Non-NaN values of each group for the feature at a given row position"""
+        row = self.expression_values[position]
+        group_values = []
+        for group_name in self.available_group_names:
+            values = row[self.group_positions[group_name]]
+            group_values.append(values[~np.isnan(values)])
+        return group_values
+    
+    def _get_aov_data(self, feature):
+        return self._get_group_values(self.feature_positions[feature])
         
     def _generate_expression_data(self):
-        dataset = self.project.datasets[self.dataset_name]
-        data_loader = DataLoader(dataset.data_dir + dataset.data_filename)
-        data_loader.load()
-        reducer = IndexReducer(data=data_loader.data, features=self.features)
+        expression_data = self.expression_data
+        if expression_data is None:
+            dataset = self.project.datasets[self.dataset_name]
+            data_loader = DataLoader(dataset.data_dir + dataset.data_filename)
+            data_loader.load()
+            expression_data = data_loader.data
+        if self.normalizers:
+            expression_data = NormalizationChain(data=expression_data, normalizers=self.normalizers).transform()
+        reducer = IndexReducer(data=expression_data, features=self.features)
         return reducer.transform()
 
     def save_results(self):
         FileService.create_folder(self.results_dir)
         # self.results.to_csv(self.results_dir + 'Anova_pvalues.csv', sep=';', index=True)
         # self.description.to_csv(self.results_dir + 'Anova_sample_sizes.csv', sep=';', index=True)
-        output_prefix = f"Anova_results_{self.dataset_name}_{len(self.features)}_genes_{len(self.available_group_names)}_groups"
+        output_prefix = f"Anova_results_{self.dataset_name}_{len(self.features)}_genes_{len(self.available_group_names)}_groups{self._get_partial_suffix()}"
+        results = self.results
+        if self.n_done<self.n_features:
+            # Cancelled analysis: tell unprocessed genes (False) from failed tests; NaN for genes absent from the data
+            processed = pd.Series(np.arange(self.n_features)<self.n_done, index=self.expression_index)
+            results = results.assign(processed=processed.reindex(results.index).astype('boolean'))
         with pd.ExcelWriter(self.results_dir + output_prefix + '.xlsx', engine='openpyxl') as writer:
-            self.results.to_excel(writer, sheet_name='p-values')
+            results.to_excel(writer, sheet_name='p-values')
             self.description.to_excel(writer, sheet_name='sample_sizes')
+            if self.generate_confidence_intervals:
+                self.confidence_intervals.to_excel(writer, sheet_name='confidence_intervals')
             significance = pd.DataFrame()
             significance.index.name = 'pval_type'
             for k, v in self.significance.items():
                 significance.loc[k, 'threshold'] = v
             significance.to_excel(writer, sheet_name='significance')
         
+    def _get_partial_suffix(self):
+        """File name suffix of the results of a cancelled analysis, with the number of processed genes"""
+        if self.n_done<self.n_features:
+            return f"_partial_{self.n_done}_of_{self.n_features}"
+        return ''
+    
     def __repr__(self):
         return (f"{self.__class__.__name__} ["
                 f"name = {self.name}, "
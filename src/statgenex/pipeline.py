@@ -0,0 +1,231 @@
+from src.statgenex.entity import Project
+from src.statgenex.expression import Anova
+from src.statgenex.service import DataLoader, IndexReducer, NormalizationChain, Log2Normalizer, QuantileNormalizer, ZScoreNormalizer, LowExpressionFilter
+from src.statgenex.stats import GroupMoments
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import argparse
+import json
+import os
+
+# ==============================
+
+class Stage:
+    """Node of the pipeline dependency graph"""
+
+    def __init__(self, key, function, dependencies=()):
+        self.key = key
+        self.function = function
+        self.dependencies = list(dependencies)
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__} [key={self.key}, dependencies={self.dependencies}]")
+
+# ==============================
+
+class Pipeline:
+    """
+    Run group generation and analysis steps declared in a JSON spec file.
+    Shared stages (dataset load and normalization, feature lists, group resolution, 
+    group moments) run once and independent stages run concurrently.
+    Normalizers are declared per dataset in the top-level normalizers section,
+    so that group moments and analyses see the same data.
+
+    pipeline.json
+    {
+        "max_workers": 4,
+        "normalizers": {
+            "TCGA-BRCA": [{"type": "low_expression", "min_expression": 1, "min_samples": 10}, {"type": "log2"}]
+        },
+        "steps": [
+            {"name": "subtypes", "type": "generate_groups", "dataset_name": "TCGA-BRCA",
+             "categorical_filters": {"Luminal-A": [{"pam50": ["luminal-A"]}]}},
+            {"name": "anova_subtypes", "type": "anova", "dataset_name": "TCGA-BRCA",
+             "group_names": ["Luminal-A", "Basal-like"], "features": ["SMYD2", "BIRC3"],
+             "options": {"generate_plots": false}}
+        ]
+    }
+    """
+
+    analyses = {'anova': Anova}
+    normalizers = {'log2': Log2Normalizer, 'quantile': QuantileNormalizer, 'zscore': ZScoreNormalizer, 'low_expression': LowExpressionFilter}
+    group_filters = ['categorical_filters', 'quantitative_filters', 'expression_filters', 'secondary_filters']
+
+    def __init__(self, project, spec_filename=None, max_workers=None):
+        self.project = project
+        self.spec_filename = spec_filename if spec_filename is not None else project.project_dir + 'pipeline.json'
+        with open(self.spec_filename, 'r', encoding='utf-8') as f:
+            self.spec = json.load(f)
+        self.steps = {step['name']: step for step in self.spec['steps']}
+        self.max_workers = max_workers if max_workers is not None else self.spec.get('max_workers')
+        self.stages = dict()
+        self.outputs = dict()
+        self.results = dict()
+
+    def run(self):
+        self._build_graph()
+        self.outputs.clear()
+        pending = dict(self.stages)
+        running = dict()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for key, stage in list(pending.items()):
+                    if all(dependency in self.outputs for dependency in stage.dependencies):
+                        args = [self.outputs[dependency] for dependency in stage.dependencies]
+                        running[executor.submit(stage.function, *args)] = key
+                        del pending[key]
+                if not running:
+                    raise ValueError(f"Cyclic or missing dependencies in pipeline stages {list(pending.keys())}")
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    key = running.pop(future)
+                    self.outputs[key] = future.result()
+        for step_name in self.steps.keys():
+            self.results[step_name] = self.outputs[('step', step_name)]
+        if any(step['type']=='generate_groups' for step in self.steps.values()):
+            self.project.dump()
+        return self.results
+
+    def _build_graph(self):
+        self.stages.clear()
+        for step_name, step in self.steps.items():
+            if step['type']!='generate_groups' and step['type'] not in self.analyses.keys():
+                raise ValueError(f"Unknown pipeline step type {step['type']} in step {step_name}")
+            dataset_name = step['dataset_name']
+            self._add_stage(('data', dataset_name), lambda dataset_name=dataset_name: self._load_data(dataset_name))
+            dependencies = [('step', name) for name in step.get('depends_on', [])]
+            if step['type']=='generate_groups':
+                self._add_stage(('expgroup', dataset_name), lambda dataset_name=dataset_name: self._load_expgroup(dataset_name))
+                self._add_stage(('step', step_name),
+                                lambda data, expgroup, *args, step=step: self._generate_groups(step, data, expgroup),
+                                [('data', dataset_name), ('expgroup', dataset_name)] + dependencies)
+        for step_name, step in self.steps.items():
+            if step['type'] in self.analyses.keys():
+                if 'normalizers' in step.get('options', dict()):
+                    raise ValueError(f"Normalizers of step {step_name} must be declared in the top-level normalizers section "
+                                     f"of the pipeline spec, for dataset {step['dataset_name']}")
+                self._add_stage(('features', step_name), lambda step=step: self._get_features(step))
+        for step_name, step in self.steps.items():
+            if step['type'] in self.analyses.keys():
+                dataset_name = step['dataset_name']
+                group_steps = self._get_group_steps(dataset_name)
+                feature_stages = [('features', name) for name in self._get_analysis_steps(dataset_name)]
+                self._add_stage(('groups', dataset_name),
+                                lambda data, *args, dataset_name=dataset_name: self._resolve_groups(dataset_name, data),
+                                [('data', dataset_name)] + group_steps)
+                self._add_stage(('moments', dataset_name),
+                                lambda data, group_positions, *features: self._calculate_moments(data, group_positions, features),
+                                [('data', dataset_name), ('groups', dataset_name)] + feature_stages)
+                dependencies = [('step', name) for name in step.get('depends_on', [])]
+                self._add_stage(('step', step_name),
+                                lambda data, group_moments, features, *args, step=step: self._perform_analysis(step, data, group_moments, features),
+                                [('data', dataset_name), ('moments', dataset_name), ('features', step_name)] + group_steps + dependencies)
+
+    def _add_stage(self, key, function, dependencies=()):
+        if key not in self.stages.keys():
+            self.stages[key] = Stage(key, function, dependencies)
+
+    def _get_group_steps(self, dataset_name):
+        return [('step', name) for name, step in self.steps.items()
+                if step['type']=='generate_groups' and step['dataset_name']==dataset_name]
+
+    def _get_analysis_steps(self, dataset_name):
+        return [name for name, step in self.steps.items()
+                if step['type'] in self.analyses.keys() and step['dataset_name']==dataset_name]
+
+    def _get_group_names(self, dataset_name):
+        group_names = []
+        for step_name in self._get_analysis_steps(dataset_name):
+            group_names.extend(gn for gn in self.steps[step_name]['group_names'] if gn not in group_names)
+        return group_names
+
+    def _load_data(self, dataset_name):
+        dataset = self.project.datasets[dataset_name]
+        data_loader = DataLoader(filename=dataset.data_dir + dataset.data_filename, ext=dataset.data_ext, sep=dataset.data_sep)
+        data_loader.load()
+        normalizer_specs = self.spec.get('normalizers', dict()).get(dataset_name, [])
+        if normalizer_specs:
+            normalizers = [self.normalizers[ns['type']](**{k: v for k, v in ns.items() if k!='type'}) for ns in normalizer_specs]
+            return NormalizationChain(data=data_loader.data, normalizers=normalizers).transform()
+        return data_loader.data
+
+    def _load_expgroup(self, dataset_name):
+        dataset = self.project.datasets[dataset_name]
+        expgroup_loader = DataLoader(filename=dataset.data_dir + dataset.expgroup_filename, ext=dataset.expgroup_ext, sep=dataset.expgroup_sep)
+        expgroup_loader.load()
+        return expgroup_loader.data
+
+    def _generate_groups(self, step, data, expgroup):
+        dataset = self.project.datasets[step['dataset_name']]
+        filters = {k: v for k, v in step.items() if k in self.group_filters}
+        dataset.generate_groups(expgroup=expgroup, expression_data=data, **filters)
+        return dataset
+
+    def _resolve_groups(self, dataset_name, data):
+        """Sample positions of each group used by the analyses of the dataset"""
+        dataset = self.project.datasets[dataset_name]
+        group_positions = dict()
+        for group_name in self._get_group_names(dataset_name):
+            if group_name in dataset.groups.keys():
+                positions = data.columns.get_indexer(dataset.groups[group_name].samples)
+                group_positions[group_name] = positions[positions>=0]
+        return group_positions
+
+    def _calculate_moments(self, data, group_positions, step_features):
+        """Group moments of the features requested by the analyses of the dataset, in the dtype of the data"""
+        features = None
+        if all(f is not None for f in step_features):
+            features = [feature for f in step_features for feature in f]
+        data = IndexReducer(data=data, features=features).transform()
+        return GroupMoments().perform(data.to_numpy(), group_positions, data.index)
+
+    def _get_features(self, step):
+        """Features of an analysis step, None for all features of the dataset"""
+        features = step.get('features')
+        if 'features_filename' in step:
+            features_loader = DataLoader(filename=self.project.data_dir + step['features_filename'],
+                                         ext=step.get('features_ext', 'csv'), sep=step.get('features_sep', ';'))
+            features_loader.load()
+            features = list(features_loader.data.index)
+        return features
+
+    def _perform_analysis(self, step, data, group_moments, features):
+        if features is None:
+            features = list(data.index)
+        analysis = self.analyses[step['type']](project=self.project,
+                                               dataset_name=step['dataset_name'],
+                                               group_names=step['group_names'],
+                                               features=features,
+                                               expression_data=data,
+                                               group_moments=group_moments,
+                                               **step.get('options', dict()))
+        analysis.perform()
+        return analysis
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__} ["
+                f"project_name = {self.project.name}, "
+                f"spec_filename = {self.spec_filename}, "
+                f"steps = {list(self.steps.keys())}"
+                f"]")
+
+# ==============================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a statgenex analysis pipeline')
+    parser.add_argument('name', help='project name')
+    parser.add_argument('root_dir', help='folder containing the project')
+    parser.add_argument('--spec', default=None, help='pipeline spec file (default: pipeline.json next to project.json)')
+    parser.add_argument('--max-workers', type=int, default=None, help='number of concurrent stages')
+    args = parser.parse_args(argv)
+    import matplotlib
+    matplotlib.use('Agg')
+    project = Project(name=args.name, root_dir=os.path.join(args.root_dir, ''))
+    project.restore()
+    pipeline = Pipeline(project, spec_filename=args.spec, max_workers=args.max_workers)
+    for step_name, result in pipeline.run().items():
+        print(f"Step {step_name}: {result.__class__.__name__} done")
+
+if __name__ == '__main__':
+    main()
+
+# ==============================
@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
 import pandas as pd
+import numpy as np
 from datetime import date, datetime
 import matplotlib as mpl
 import matplotlib.cm as cm
@@ -7,6 +8,7 @@ import matplotlib.colors as clr
 import warnings
 import openpyxl
 import os
+import threading
 
 # ============================== 
 
@@ -42,14 +44,42 @@ class FileService:
     
     @classmethod
     def create_folder(cls, folder):
-        if not os.path.exists(folder):
-            os.makedirs(folder)
+        os.makedirs(folder, exist_ok=True)
             
     
 # ==============================    
     
+class IndexService:
+    
+    @classmethod
+    def get_positions(cls, labels, features):
+        """
+        Positions of the labels found in features, in the order of the labels.
+        For unique labels, the lookup uses the hash table that pandas builds 
+        once per Index object and reuses for subsequent calls.
+        """
+        features = list(features)
+        if labels.is_unique:
+            positions = labels.get_indexer(features)
+            return np.unique(positions[positions>=0])
+        return np.flatnonzero(labels.isin(features))
+    
+    @classmethod
+    def take(cls, data, positions, axis=0):
+        """Select positions along an axis, as a slice (no copy) when they are contiguous"""
+        if len(positions)>0 and positions[-1] - positions[0] + 1==len(positions):
+            positions = slice(positions[0], positions[-1] + 1)
+        if axis==0:
+            return data.iloc[positions]
+        return data.iloc[:, positions]
+    
+# ==============================    
+    
 class FigureService:
     
+    # pyplot is not thread-safe: figures are generated one at a time
+    lock = threading.RLock()
+    
     @classmethod
     def get_significance_symbol(cls, pvalue, oneStar=0.05, twoStars=0.01, threeStars=0.001):
         symbol = ''
@@ -209,8 +239,8 @@ class ColumnReducer(Transformer):
     
     def transform(self) -> pd.DataFrame:
         if self.features:
-            available_features = sorted(list(set(self.data.columns).intersection(set(self.features))))
-            return self.data[available_features]
+            positions = IndexService.get_positions(self.data.columns, self.features)
+            return IndexService.take(self.data, positions, axis=1)
         return self.data
     
 # ==============================
@@ -224,8 +254,163 @@ class IndexReducer(Transformer):
     
     def transform(self) -> pd.DataFrame:
         if self.features:
-            available_features = sorted(list(set(self.data.index).intersection(set(self.features))))
-            return self.data.loc[available_features]
+            positions = IndexService.get_positions(self.data.index, self.features)
+            return IndexService.take(self.data, positions, axis=0)
         return self.data
 
 # ==============================
+
+class Normalizer(Transformer):
+    """
+    Interface in-place normalization of an expression matrix (features x samples).
+    transform() makes a single float32 copy of the data; normalize() then works 
+    in place on the values, by chunks of rows where possible.
+    """
+    
+    chunk_size = 4096
+    
+    def __init__(self, data: pd.DataFrame = None):
+        self.data = data
+    
+    def transform(self) -> pd.DataFrame:
+        values = self.data.to_numpy(dtype=np.float32, copy=True)
+        values, index = self.normalize(values, self.data.index)
+        return pd.DataFrame(values, index=index, columns=self.data.columns, copy=False)
+    
+    @abstractmethod
+    def normalize(self, values: np.ndarray, index: pd.Index) -> tuple[np.ndarray, pd.Index]:
+        ...
+    
+    def _chunks(self, n_rows):
+        for start in range(0, n_rows, self.chunk_size):
+            yield slice(start, min(start + self.chunk_size, n_rows))
+
+# ==============================
+
+class NormalizationChain(Normalizer):
+    """Apply several normalizers in turn on a single float32 copy of the data"""
+    
+    def __init__(self, data: pd.DataFrame, normalizers: list):
+        super().__init__(data)
+        self.normalizers = normalizers
+    
+    def normalize(self, values, index):
+        for normalizer in self.normalizers:
+            values, index = normalizer.normalize(values, index)
+        return values, index
+
+# ==============================
+
+class Log2Normalizer(Normalizer):
+    """log2(x + pseudocount)"""
+    
+    def __init__(self, data: pd.DataFrame = None, pseudocount=1.0):
+        super().__init__(data)
+        self.pseudocount = pseudocount
+    
+    def normalize(self, values, index):
+        for chunk in self._chunks(values.shape[0]):
+            np.add(values[chunk], self.pseudocount, out=values[chunk])
+            np.log2(values[chunk], out=values[chunk])
+        return values, index
+
+# ==============================
+
+class ZScoreNormalizer(Normalizer):
+    """Z-score of each feature across samples"""
+    
+    def __init__(self, data: pd.DataFrame = None, ddof=0):
+        super().__init__(data)
+        self.ddof = ddof
+    
+    def normalize(self, values, index):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            for chunk in self._chunks(values.shape[0]):
+                mean = np.nanmean(values[chunk], axis=1, keepdims=True)
+                std = np.nanstd(values[chunk], axis=1, ddof=self.ddof, keepdims=True)
+                std[std==0] = 1
+                np.subtract(values[chunk], mean, out=values[chunk])
+                np.divide(values[chunk], std, out=values[chunk])
+        return values, index
+
+# ==============================
+
+class LowExpressionFilter(Normalizer):
+    """Keep features expressed at min_expression or more in at least min_samples samples"""
+    
+    def __init__(self, data: pd.DataFrame = None, min_expression=1.0, min_samples=1):
+        super().__init__(data)
+        self.min_expression = min_expression
+        self.min_samples = min_samples
+    
+    def normalize(self, values, index):
+        keep = np.zeros(values.shape[0], dtype=bool)
+        for chunk in self._chunks(values.shape[0]):
+            keep[chunk] = (values[chunk]>=self.min_expression).sum(axis=1)>=self.min_samples
+        positions = np.flatnonzero(keep)
+        # Move kept rows up in place: each chunk is written at or before the rows it is read from
+        for start in range(0, len(positions), self.chunk_size):
+            chunk_positions = positions[start:start + self.chunk_size]
+            values[start:start + len(chunk_positions)] = values[chunk_positions]
+        return values[:len(positions)], index[positions]
+
+# ==============================
+
+class QuantileNormalizer(Normalizer):
+    """
+    Quantile normalization of samples.
+    Each column is sorted once; the sort order is kept to assign the values
+    of the reference distribution (mean of the sorted columns), tied values 
+    receiving the mean of the reference over their ranks. A reference 
+    computed on another dataset can be provided to normalize new samples;
+    otherwise the reference is computed on each call and kept in 
+    computed_reference, so one instance can be reused on other matrices.
+    """
+    
+    def __init__(self, data: pd.DataFrame = None, reference=None):
+        super().__init__(data)
+        self.reference = reference
+        self.computed_reference = None
+    
+    def normalize(self, values, index):
+        n_rows, n_cols = values.shape
+        orders = np.empty((n_rows, n_cols), dtype=np.int32)
+        n_values = np.zeros(n_cols, dtype=int)
+        reference = np.zeros(n_rows, dtype=float)
+        n_references = 0
+        for j in range(n_cols):
+            orders[:, j] = np.argsort(values[:, j], kind='stable')
+            n_values[j] = n_rows - np.isnan(values[:, j]).sum()
+            if self.reference is None and n_values[j]>0:
+                sorted_values = values[orders[:n_values[j], j], j]
+                reference += self._resample(sorted_values, n_rows)
+                n_references += 1
+        if self.reference is None:
+            reference = reference / max(1, n_references)
+            self.computed_reference = reference
+        else:
+            reference = np.asarray(self.reference, dtype=float)
+        for j in range(n_cols):
+            n = n_values[j]
+            sorted_values = values[orders[:n, j], j]
+            values[orders[:n, j], j] = self._average_ties(sorted_values, self._resample(reference, n))
+        return values, index
+    
+    def _average_ties(self, sorted_values, targets):
+        """Each run of tied values gets the mean of the reference values over its ranks"""
+        if len(sorted_values)==0:
+            return targets
+        starts = np.flatnonzero(np.concatenate([[True], sorted_values[1:]!=sorted_values[:-1]]))
+        if len(starts)==len(sorted_values):
+            return targets
+        sums = np.add.reduceat(targets, starts)
+        lengths = np.diff(np.append(starts, len(sorted_values)))
+        return np.repeat(sums / lengths, lengths)
+    
+    def _resample(self, sorted_values, n):
+        if len(sorted_values)==n:
+            return sorted_values
+        return np.interp(np.linspace(0, 1, n), np.linspace(0, 1, len(sorted_values)), sorted_values)
+
+# ==============================
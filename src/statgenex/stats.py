@@ -1,15 +1,181 @@
 import math
-from scipy.stats import rankdata
+import os
+import warnings
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from scipy.stats import f
+from src.statgenex.correction import BenjaminiHochberg
 
 # ============================== 
 
-class BenjaminiHochberg():
+class GroupMoments():
+    """
+    Per-group sample size, mean and sum of squared deviations of each feature.
+    Values (features x samples) are read by chunks of rows in their own dtype.
+    """
 
-    def perform(self, p_vals):
-        ranked_p_values = rankdata(p_vals)
-        fdr = p_vals * len(p_vals) / ranked_p_values
-        fdr[fdr > 1] = 1
-        return fdr
+    chunk_size = 4096
+
+    def __init__(self) -> None:
+        self.sizes = pd.DataFrame()
+        self.means = pd.DataFrame()
+        self.sum_squares = pd.DataFrame()
+
+    def perform(self, values, group_positions, index):
+        if not np.issubdtype(values.dtype, np.floating):
+            values = values.astype(float)
+        n_rows = values.shape[0]
+        sizes = {group_name: np.zeros(n_rows, dtype=np.int64) for group_name in group_positions.keys()}
+        means = {group_name: np.zeros(n_rows) for group_name in group_positions.keys()}
+        sum_squares = {group_name: np.zeros(n_rows) for group_name in group_positions.keys()}
+        for start in range(0, n_rows, self.chunk_size):
+            chunk = slice(start, min(start + self.chunk_size, n_rows))
+            for group_name, positions in group_positions.items():
+                group_values = values[chunk][:, positions]
+                n = (~np.isnan(group_values)).sum(axis=1)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    mean = np.nansum(group_values, axis=1, dtype=float) / n
+                sizes[group_name][chunk] = n
+                means[group_name][chunk] = mean
+                sum_squares[group_name][chunk] = np.nansum((group_values - mean[:, np.newaxis])**2, axis=1)
+        self.sizes = pd.DataFrame(sizes, index=index)
+        self.means = pd.DataFrame(means, index=index)
+        self.sum_squares = pd.DataFrame(sum_squares, index=index)
+        return self
+    
+    def select(self, features, group_names):
+        """Moments as arrays of shape (features, groups)"""
+        return tuple(m[~m.index.duplicated()].reindex(index=features, columns=group_names).to_numpy(dtype=float) 
+                     for m in (self.sizes, self.means, self.sum_squares))
+
+# ============================== 
+
+class OneWayAnova():
+    """One-way ANOVA F-test of all features at once from group moments"""
+
+    def perform(self, sizes, means, sum_squares):
+        ss_between, ss_within, df_between, df_within, invalid = self.sum_of_squares(sizes, means, sum_squares)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            f_stat = (ss_between / df_between) / (ss_within / df_within)
+            p_vals = f.sf(f_stat, df_between, df_within)
+        p_vals[invalid] = np.nan
+        return p_vals
+    
+    def sum_of_squares(self, sizes, means, sum_squares):
+        """Between and within sums of squares with their degrees of freedom"""
+        n_groups = sizes.shape[1]
+        n_total = sizes.sum(axis=1)
+        df_between = n_groups - 1
+        df_within = n_total - n_groups
+        with np.errstate(invalid='ignore', divide='ignore'):
+            grand_mean = (sizes * means).sum(axis=1) / n_total
+            ss_between = (sizes * (means - grand_mean[:, np.newaxis])**2).sum(axis=1)
+        ss_within = sum_squares.sum(axis=1)
+        invalid = (sizes<1).any(axis=1) | (df_within<=0) | (df_between<1)
+        return ss_between, ss_within, df_between, df_within, invalid
+
+# ============================== 
+
+class EffectSize():
+    """Effect sizes of one-way comparisons of all features at once"""
+
+    def perform(self, sizes, means, sum_squares, h_stats):
+        ss_between, ss_within, df_between, df_within, invalid = OneWayAnova().sum_of_squares(sizes, means, sum_squares)
+        ss_total = ss_between + ss_within
+        n_total = sizes.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ms_within = ss_within / df_within
+            eta2 = ss_between / ss_total
+            omega2 = (ss_between - df_between * ms_within) / (ss_total + ms_within)
+            epsilon2 = h_stats / ((n_total**2 - 1) / (n_total + 1))
+        eta2[invalid] = np.nan
+        omega2[invalid] = np.nan
+        return {'eta2_anova': eta2, 'omega2_anova': omega2, 'epsilon2_kw': epsilon2}
+
+# ============================== 
+
+class Bootstrap():
+    """
+    Bootstrap confidence intervals of group means and medians for all features at once.
+    Resample indices are drawn once per group and applied to chunks of features 
+    processed over a thread pool. The number of concurrent chunks and their size are
+    set so that the resample indices and the gathered resamples of all workers stay
+    within max_memory bytes; when a single feature does not fit, one worker gathers
+    its resamples by blocks.
+    """
+
+    # Arrays of the size of the gathered resamples alive at once in a worker (sorted in place for the medians),
+    # besides their one-byte validity mask
+    n_temporaries = 1
+
+    def __init__(self, n_resamples=2000, confidence_level=0.95, max_memory=2**28, max_workers=None, random_state=None) -> None:
+        self.n_resamples = n_resamples
+        self.confidence_level = confidence_level
+        self.max_memory = max_memory
+        self.max_workers = max_workers
+        self.random_state = random_state
+
+    def perform(self, values, group_positions):
+        rng = np.random.default_rng(self.random_state)
+        alpha = 1 - self.confidence_level
+        percentiles = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+        max_workers = self.max_workers if self.max_workers is not None else min(32, (os.cpu_count() or 1) + 4)
+        intervals = dict()
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            for group_name, positions in group_positions.items():
+                resamples = np.empty((self.n_resamples, 0), dtype=int)
+                if len(positions)>0:
+                    resamples = positions[rng.integers(0, len(positions), size=(self.n_resamples, len(positions)))]
+                # Bytes per resample of a feature: gathered values, validity mask, resampled mean and median
+                resample_bytes = len(positions) * (values.itemsize * self.n_temporaries + 1) + 2 * np.dtype(float).itemsize
+                available = max(0, self.max_memory - resamples.nbytes)
+                n_workers = int(max(1, min(max_workers, available // (self.n_resamples * resample_bytes))))
+                chunk_size = int(max(1, available // (n_workers * self.n_resamples * resample_bytes)))
+                block_size = int(max(1, min(self.n_resamples, available // (n_workers * resample_bytes))))
+                chunks = [(start, min(start + chunk_size, values.shape[0])) for start in range(0, values.shape[0], chunk_size)]
+                with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                    chunk_stats = list(executor.map(lambda chunk: self._resample(values, chunk, positions, resamples, block_size, percentiles), chunks))
+                columns = [group_name + '_mean', group_name + '_median', 
+                           group_name + '_mean_ci_low', group_name + '_mean_ci_high', 
+                           group_name + '_median_ci_low', group_name + '_median_ci_high']
+                for i, column in enumerate(columns):
+                    intervals[column] = np.concatenate([stats[i] for stats in chunk_stats]) if chunks else np.array([])
+        return intervals
+
+    def _resample(self, values, chunk, positions, resamples, block_size, percentiles):
+        start, stop = chunk
+        chunk_values = values[start:stop]
+        group_values = chunk_values[:, positions]
+        mean = np.nanmean(group_values, axis=1)
+        median = np.nanmedian(group_values, axis=1)
+        if resamples.shape[1]==0:
+            empty = np.full(stop - start, np.nan)
+            return mean, median, empty, empty, empty, empty
+        sample_means = np.empty((stop - start, self.n_resamples))
+        sample_medians = np.empty((stop - start, self.n_resamples))
+        for first in range(0, self.n_resamples, block_size):
+            last = min(first + block_size, self.n_resamples)
+            sample = chunk_values[:, resamples[first:last]]
+            is_valid = np.isnan(sample)
+            np.logical_not(is_valid, out=is_valid)
+            n_valid = is_valid.sum(axis=2)
+            sample_means[:, first:last] = np.sum(sample, axis=2, where=is_valid) / n_valid
+            del is_valid
+            sample.sort(axis=2)
+            sample_medians[:, first:last] = self._sorted_median(sample, n_valid)
+            del sample
+        mean_ci = np.nanpercentile(sample_means, percentiles, axis=1)
+        median_ci = np.nanpercentile(sample_medians, percentiles, axis=1)
+        return mean, median, mean_ci[0], mean_ci[1], median_ci[0], median_ci[1]
+
+    def _sorted_median(self, sample, n_valid):
+        """Median along the last axis of values sorted with NaNs last, n_valid being the number of non-NaN values"""
+        low = np.take_along_axis(sample, ((n_valid - 1) // 2)[..., np.newaxis], axis=2)[..., 0]
+        high = np.take_along_axis(sample, (n_valid // 2)[..., np.newaxis], axis=2)[..., 0]
+        median = (low + high) / 2
+        return np.where(n_valid>0, median, np.nan)
 
 # ============================== 
 
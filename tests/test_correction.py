@@ -0,0 +1,162 @@
+import os
+import tracemalloc
+import numpy as np
+import pandas as pd
+import pytest
+from src.statgenex.correction import BenjaminiHochberg, BenjaminiYekutieli, Holm, StoreyQValue, ExternalCorrection
+
+# ==============================
+
+def reference_bh(p_vals, factor=1.0):
+    """q_(i) = min over j >= i of factor * n * p_(j) / j"""
+    n = len(p_vals)
+    order = np.argsort(p_vals, kind='stable')
+    q = np.empty(n)
+    running = np.inf
+    for k in range(n - 1, -1, -1):
+        running = min(running, factor * n * p_vals[order[k]] / (k + 1))
+        q[order[k]] = min(running, 1)
+    return q
+
+def reference_by(p_vals):
+    return reference_bh(p_vals, factor=sum(1.0 / i for i in range(1, len(p_vals) + 1)))
+
+def reference_holm(p_vals):
+    """p_(i) adjusted = max over j <= i of (n - j + 1) * p_(j)"""
+    n = len(p_vals)
+    order = np.argsort(p_vals, kind='stable')
+    q = np.empty(n)
+    running = 0
+    for k in range(n):
+        running = max(running, (n - k) * p_vals[order[k]])
+        q[order[k]] = min(running, 1)
+    return q
+
+def reference_storey(p_vals, lambda_=0.5):
+    pi0 = min(1, max(1, (p_vals>lambda_).sum()) / (len(p_vals) * (1 - lambda_)))
+    return np.minimum(1, pi0 * reference_bh(p_vals))
+
+CASES = [
+    (BenjaminiHochberg, reference_bh),
+    (BenjaminiYekutieli, reference_by),
+    (Holm, reference_holm),
+    (StoreyQValue, reference_storey),
+    ]
+
+@pytest.fixture
+def p_vals():
+    rng = np.random.default_rng(0)
+    p_vals = np.concatenate([rng.uniform(size=2000), rng.uniform(0, 1e-4, size=300), np.round(rng.uniform(size=300), 2), np.ones(100)])
+    rng.shuffle(p_vals)
+    return p_vals
+
+def with_nans(p_vals):
+    p_vals = p_vals.copy()
+    p_vals[::37] = np.nan
+    return p_vals
+
+def reference_with_nans(reference, p_vals):
+    expected = np.full(len(p_vals), np.nan)
+    valid = ~np.isnan(p_vals)
+    expected[valid] = reference(p_vals[valid])
+    return expected
+
+# ==============================
+
+@pytest.mark.parametrize('correction, reference', CASES)
+def test_matches_reference(correction, reference, p_vals):
+    assert np.allclose(correction().perform(p_vals), reference(p_vals))
+
+@pytest.mark.parametrize('correction, reference', CASES)
+def test_nans_are_skipped(correction, reference, p_vals):
+    p_vals = with_nans(p_vals)
+    adjusted = correction().perform(p_vals)
+    assert np.allclose(adjusted, reference_with_nans(reference, p_vals), equal_nan=True)
+    assert np.isnan(adjusted[np.isnan(p_vals)]).all()
+
+@pytest.mark.parametrize('correction, reference', CASES)
+def test_monotone_and_ties_equal(correction, reference, p_vals):
+    adjusted = correction().perform(p_vals)
+    order = np.argsort(p_vals, kind='stable')
+    assert (np.diff(adjusted[order])>=0).all()
+    for value in [1.0, 0.5]:
+        assert len(np.unique(adjusted[p_vals==value]))==1
+
+@pytest.mark.parametrize('correction, reference', CASES)
+def test_columns_corrected_independently(correction, reference, p_vals):
+    data = pd.DataFrame({'a': with_nans(p_vals), 'b': p_vals[::-1]}, index=[f"g{i}" for i in range(len(p_vals))])
+    adjusted = correction().perform(data)
+    assert list(adjusted.columns)==['a', 'b'] and (adjusted.index==data.index).all()
+    for column in data.columns:
+        assert np.allclose(adjusted[column], reference_with_nans(reference, data[column].to_numpy()), equal_nan=True)
+
+def test_series_and_small_cases():
+    adjusted = BenjaminiHochberg().perform(pd.Series([0.01, np.nan, 0.04, 0.03], name='pval'))
+    assert adjusted.name=='pval'
+    assert np.allclose(adjusted, [0.03, np.nan, 0.04, 0.04], equal_nan=True)
+    assert np.isnan(BenjaminiHochberg().perform(np.array([np.nan, np.nan]))).all()
+    assert len(Holm().perform(np.array([])))==0
+
+# ==============================
+
+@pytest.mark.parametrize('correction, reference', CASES)
+@pytest.mark.parametrize('chunk_size, bucket_size', [(1000, 300), (5000, 50), (10**7, 10**7)])
+def test_external_matches_in_memory(correction, reference, p_vals, tmp_path, chunk_size, bucket_size):
+    p_vals = with_nans(p_vals)
+    external = ExternalCorrection(correction(), directory=tmp_path, chunk_size=chunk_size, bucket_size=bucket_size)
+    chunks = (p_vals[start:start + 700] for start in range(0, len(p_vals), 700))
+    adjusted = np.array(external.perform(chunks, str(tmp_path / 'adjusted.bin')))
+    assert np.allclose(adjusted, correction().perform(p_vals), equal_nan=True)
+
+def test_external_concentrated_values_and_ties(tmp_path):
+    rng = np.random.default_rng(1)
+    p_vals = np.concatenate([rng.uniform(0, 1e-12, size=3000), np.ones(2000), rng.uniform(size=500)])
+    rng.shuffle(p_vals)
+    external = ExternalCorrection(BenjaminiHochberg(), directory=tmp_path, chunk_size=1000, bucket_size=200)
+    adjusted = np.array(external.perform([p_vals], str(tmp_path / 'adjusted.bin')))
+    assert np.allclose(adjusted, reference_bh(p_vals))
+
+def test_external_bucket_size_is_bounded(tmp_path):
+    p_vals = np.concatenate([np.full(1000, 1e-20), np.linspace(0, 1e-15, 1000), np.ones(1000)])
+    external = ExternalCorrection(Holm(), directory=tmp_path, bucket_size=100)
+    external._tmp_dir, external._n_files = str(tmp_path), 0
+    source = str(tmp_path / 'source')
+    p_vals.tofile(source + '.p')
+    np.arange(len(p_vals), dtype=np.int64).tofile(source + '.pos')
+    buckets = external._partition(source, len(p_vals), p_vals.min(), p_vals.max())
+    assert max(stop - start for _, _, start, stop in buckets)<=100
+    assert sum(stop - start for _, _, start, stop in buckets)==len(p_vals)
+
+def test_external_with_few_file_descriptors(tmp_path):
+    resource = pytest.importorskip('resource')
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(64, hard), hard))
+    try:
+        p_vals = np.random.default_rng(2).uniform(size=30000)
+        external = ExternalCorrection(BenjaminiHochberg(), directory=tmp_path, chunk_size=5000, bucket_size=100)
+        adjusted = np.array(external.perform([p_vals], str(tmp_path / 'adjusted.bin')))
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    assert np.allclose(adjusted, reference_bh(p_vals))
+
+def test_external_by_with_large_n_and_small_buckets(tmp_path):
+    p_vals = np.random.default_rng(5).uniform(size=1_000_000)
+    external = ExternalCorrection(BenjaminiYekutieli(), directory=tmp_path, chunk_size=20_000, bucket_size=2_000)
+    adjusted = np.array(external.perform(np.array_split(p_vals, 50), str(tmp_path / 'adjusted.bin')))
+    assert np.allclose(adjusted, BenjaminiYekutieli().perform(p_vals))
+
+def test_by_factors_memory_does_not_grow_with_n():
+    ranks = np.arange(1, 1001)
+    tracemalloc.start()
+    factors = BenjaminiYekutieli().factors(ranks, 50_000_000, 0)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak<100 * ranks.nbytes
+    assert np.isclose(factors[0], 50_000_000 * BenjaminiYekutieli.harmonic(50_000_000))
+
+def test_by_harmonic_number():
+    exact = np.sum(1.0 / np.arange(2_000_000, 0, -1))
+    assert np.isclose(BenjaminiYekutieli.harmonic(2_000_000), exact, rtol=1e-12)
+    assert BenjaminiYekutieli.harmonic(1)==1.0
+
+# ==============================
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+from src.statgenex.service import QuantileNormalizer
+
+# ==============================
+
+def test_quantile_ties_do_not_depend_on_row_order():
+    data = pd.DataFrame({'s1': [0, 0, 0, 5], 's2': [0, 0, 0, 9], 's3': [1, 0, 0, 7]},
+                        index=['g1', 'g2', 'g3', 'g4'], dtype=float)
+    normalized = QuantileNormalizer(data=data).transform()
+    reference = np.array([0, 0, 1 / 3, 7])
+    assert np.allclose(normalized['s1'], [1 / 9, 1 / 9, 1 / 9, 7], atol=1e-6)
+    assert np.allclose(normalized['s2'], normalized['s1'])
+    assert np.allclose(normalized['s3'], [reference[2], 0, 0, 7], atol=1e-6)
+    shuffled = QuantileNormalizer(data=data.iloc[::-1]).transform()
+    assert np.allclose(shuffled.loc[data.index], normalized, atol=1e-6)
+
+def test_quantile_without_ties_matches_reference():
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(rng.normal(size=(50, 4)), columns=['a', 'b', 'c', 'd'])
+    normalized = QuantileNormalizer(data=data).transform()
+    reference = np.sort(data.to_numpy(dtype=np.float32), axis=0).mean(axis=1)
+    assert np.allclose(np.sort(normalized.to_numpy(), axis=0), reference[:, np.newaxis], atol=1e-5)
+
+def test_quantile_nans_are_kept_and_skipped():
+    data = pd.DataFrame({'s1': [1, 2, np.nan, 4], 's2': [3, 3, 1, 2]}, dtype=float)
+    normalized = QuantileNormalizer(data=data).transform()
+    assert np.isnan(normalized.loc[2, 's1'])
+    assert not normalized['s2'].isna().any()
+    assert normalized.loc[0, 's2']==normalized.loc[1, 's2']
+    assert (np.diff(normalized['s1'].dropna().to_numpy())>0).all()
+
+def test_quantile_given_reference_with_ties():
+    data = pd.DataFrame({'s1': [2, 2, 1, 3]}, dtype=float)
+    normalized = QuantileNormalizer(data=data, reference=[10, 20, 30, 40]).transform()
+    assert np.allclose(normalized['s1'], [25, 25, 10, 40])
+
+# ==============================
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from scipy.stats import f_oneway, kruskal
+from src.statgenex.stats import GroupMoments, OneWayAnova, EffectSize, Bootstrap
+
+# ==============================
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(30, 45)) + np.repeat([0.0, 0.5, 1.0], 15) * rng.uniform(size=(30, 1))
+    values[rng.uniform(size=values.shape)<0.05] = np.nan
+    group_positions = {'a': np.arange(0, 15), 'b': np.arange(15, 30), 'c': np.arange(30, 45)}
+    return values, group_positions
+
+def get_moments(values, group_positions):
+    moments = GroupMoments().perform(values, group_positions, np.arange(values.shape[0]))
+    return moments.select(np.arange(values.shape[0]), list(group_positions.keys()))
+
+def get_groups(row, group_positions):
+    return [row[positions][~np.isnan(row[positions])] for positions in group_positions.values()]
+
+def test_anova_matches_scipy(data):
+    values, group_positions = data
+    p_vals = OneWayAnova().perform(*get_moments(values, group_positions))
+    expected = [f_oneway(*get_groups(row, group_positions)).pvalue for row in values]
+    assert np.allclose(p_vals, expected)
+
+def test_effect_sizes_match_formulas(data):
+    values, group_positions = data
+    h_stats = np.array([kruskal(*get_groups(row, group_positions)).statistic for row in values])
+    effect_sizes = EffectSize().perform(*get_moments(values, group_positions), h_stats)
+    for i, row in enumerate(values):
+        groups = get_groups(row, group_positions)
+        pooled = np.concatenate(groups)
+        n, k = len(pooled), len(groups)
+        ss_total = ((pooled - pooled.mean())**2).sum()
+        ss_between = sum(len(g) * (g.mean() - pooled.mean())**2 for g in groups)
+        ms_within = (ss_total - ss_between) / (n - k)
+        assert np.isclose(effect_sizes['eta2_anova'][i], ss_between / ss_total)
+        assert np.isclose(effect_sizes['omega2_anova'][i], (ss_between - (k - 1) * ms_within) / (ss_total + ms_within))
+        assert np.isclose(effect_sizes['epsilon2_kw'][i], h_stats[i] / (n - 1))
+
+def test_effect_sizes_invalid_groups():
+    sizes, means, sum_squares = np.array([[3, 0]]), np.array([[1.0, np.nan]]), np.array([[2.0, 0.0]])
+    effect_sizes = EffectSize().perform(sizes, means, sum_squares, np.array([np.nan]))
+    assert np.isnan(effect_sizes['eta2_anova'][0]) and np.isnan(effect_sizes['omega2_anova'][0])
+
+def reference_bootstrap(values, positions, n_resamples, confidence_level, random_state):
+    rng = np.random.default_rng(random_state)
+    resamples = positions[rng.integers(0, len(positions), size=(n_resamples, len(positions)))]
+    alpha = 1 - confidence_level
+    percentiles = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+    sample = values[:, resamples]
+    return (np.nanpercentile(np.nanmean(sample, axis=2), percentiles, axis=1),
+            np.nanpercentile(np.nanmedian(sample, axis=2), percentiles, axis=1))
+
+@pytest.mark.parametrize('max_memory, max_workers', [(2**28, None), (20_000, 4), (1, 2)])
+def test_bootstrap_matches_reference(data, max_memory, max_workers):
+    values, group_positions = data
+    positions = group_positions['b']
+    intervals = Bootstrap(n_resamples=300, max_memory=max_memory, max_workers=max_workers, random_state=7).perform(values, {'b': positions})
+    mean_ci, median_ci = reference_bootstrap(values, positions, 300, 0.95, 7)
+    assert np.allclose(intervals['b_mean'], np.nanmean(values[:, positions], axis=1))
+    assert np.allclose(intervals['b_median'], np.nanmedian(values[:, positions], axis=1))
+    assert np.allclose(intervals['b_mean_ci_low'], mean_ci[0]) and np.allclose(intervals['b_mean_ci_high'], mean_ci[1])
+    assert np.allclose(intervals['b_median_ci_low'], median_ci[0]) and np.allclose(intervals['b_median_ci_high'], median_ci[1])
+    assert (intervals['b_mean_ci_low']<=intervals['b_mean_ci_high']).all()
+
+def test_bootstrap_empty_and_missing_groups(data):
+    values, _ = data
+    values = values.copy()
+    values[0, :10] = np.nan
+    intervals = Bootstrap(n_resamples=50, random_state=1).perform(values, {'a': np.arange(10), 'e': np.array([], dtype=int)})
+    assert np.isnan(intervals['a_mean_ci_low'][0]) and np.isnan(intervals['a_median_ci_high'][0])
+    assert np.isnan(intervals['e_mean']).all() and np.isnan(intervals['e_median_ci_low']).all()
+
+# ==============================